@@ -2,12 +2,15 @@
 Strands agent that orchestrates modernization analysis.
 """
 import asyncio
-import json
 import os
-from concurrent.futures import ThreadPoolExecutor
-from queue import Empty, Queue
-from typing import AsyncIterator
-
+import threading
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
+import boto3
+import orjson
+from botocore.config import Config as BotocoreConfig
 from strands import Agent
 from strands.models.bedrock import BedrockModel
 
@@ -17,6 +20,7 @@ from tools import (
     detect_tech_stack,
     list_repository_files,
     read_file_content,
+    read_files_batch,
 )
 
 # ---------------------------------------------------------------------------
@@ -63,6 +67,9 @@ Your analysis MUST cover these categories (only those applicable to the codebase
 3. Read key files: entry points, configuration, package manifests, CI config, a sample of source files
 4. Synthesize your findings into actionable recommendations
 
+When you need several files, read them together: use read_files_batch, or request
+multiple tool calls in a single message. Independent tool calls run in parallel.
+
 ## Output format:
 Structure your final output as a clear markdown report with:
 - **Executive Summary** (3-5 sentences)
@@ -74,110 +81,408 @@ Structure your final output as a clear markdown report with:
 Be specific. Reference actual file names and code patterns you observed. Avoid generic advice.
 """
 
-# Shared thread pool for blocking agent calls
-_executor = ThreadPoolExecutor(max_workers=4)
+# ---------------------------------------------------------------------------
+# Prompt caching
+# ---------------------------------------------------------------------------
+
+# Bedrock prompt caching puts cache points after the system prompt and the tool
+# schemas, so every agent turn after the first re-reads them from cache instead
+# of paying full prefill. Set DISABLE_PROMPT_CACHING=true to opt out.
+PROMPT_CACHING_ENABLED = os.getenv("DISABLE_PROMPT_CACHING", "").lower() not in ("1", "true", "yes")
+
+# Claude generations that predate Bedrock prompt caching (cachePoint is rejected)
+_NO_CACHE_MODELS = (
+    "claude-v2", "claude-instant", "claude-3-haiku", "claude-3-sonnet",
+    "claude-3-opus", "claude-3-5-sonnet",
+)
+
+
+@lru_cache(maxsize=32)
+def _profile_model_arn(profile_arn: str, aws_region: str) -> str:
+    """Resolve an application inference profile ARN to its underlying model ARN."""
+    client = boto3.client("bedrock", region_name=aws_region)
+    resp = client.get_inference_profile(inferenceProfileIdentifier=profile_arn)
+    return resp["models"][0]["modelArn"]
+
+
+def _supports_prompt_caching(model_id: str, aws_region: str) -> bool:
+    if not PROMPT_CACHING_ENABLED:
+        return False
+    if model_id.startswith("arn:") and ":application-inference-profile/" in model_id:
+        try:
+            model_id = _profile_model_arn(model_id, aws_region)
+        except Exception:
+            return False
+    if "anthropic.claude" not in model_id:
+        return False
+    return not any(name in model_id for name in _NO_CACHE_MODELS)
+
+
+# ---------------------------------------------------------------------------
+# Context compaction — tool results (file contents, listings) pile up in the
+# history and are re-sent on every turn. Once they exceed a budget, all but the
+# most recent few are cut down to their first lines in the outgoing request.
+# ---------------------------------------------------------------------------
+
+CONTEXT_COMPACT_CHARS = int(os.getenv("CONTEXT_COMPACT_CHARS", "40000"))
+_KEEP_RECENT_RESULTS = 3
+_ELIDED_HEAD_CHARS = 400
+
+
+def _tool_result_chars(block: dict) -> int:
+    return sum(len(item.get("text", "")) for item in block["toolResult"].get("content", []))
+
+
+def _elide_tool_result(block: dict) -> dict:
+    content = []
+    for item in block["toolResult"].get("content", []):
+        text = item.get("text")
+        if text is not None and len(text) > _ELIDED_HEAD_CHARS:
+            item = {
+                "text": f"{text[:_ELIDED_HEAD_CHARS]}\n[... {len(text) - _ELIDED_HEAD_CHARS} "
+                "more characters of this earlier tool result omitted; call the tool again if needed]"
+            }
+        content.append(item)
+    return {"toolResult": {**block["toolResult"], "content": content}}
+
+
+def _compact_tool_results(messages: list) -> list:
+    """Return `messages` with older tool results elided; the input is not modified."""
+    positions = [
+        (i, j)
+        for i, message in enumerate(messages)
+        for j, block in enumerate(message["content"])
+        if "toolResult" in block
+    ]
+    if len(positions) <= _KEEP_RECENT_RESULTS:
+        return messages
+    total = sum(_tool_result_chars(messages[i]["content"][j]) for i, j in positions)
+    if total <= CONTEXT_COMPACT_CHARS:
+        return messages
+
+    old = set(positions[:-_KEEP_RECENT_RESULTS])
+    compacted = list(messages)
+    for i in {i for i, _ in old}:
+        compacted[i] = {
+            **messages[i],
+            "content": [
+                _elide_tool_result(block) if (i, j) in old else block
+                for j, block in enumerate(messages[i]["content"])
+            ],
+        }
+    return compacted
+
+
+class _CompactingBedrockModel(BedrockModel):
+    """BedrockModel that sends a compacted history; the agent's own history is untouched."""
+
+    def format_request(self, messages, tool_specs=None, system_prompt=None):
+        return super().format_request(_compact_tool_results(messages), tool_specs, system_prompt)
+
+
+# ---------------------------------------------------------------------------
+# Model cache — one BedrockModel (and boto3 client / connection pool) per
+# (model_id, region), shared by all requests
+# ---------------------------------------------------------------------------
+
+_BOTO_CLIENT_CONFIG = BotocoreConfig(
+    max_pool_connections=32,
+    retries={"mode": "adaptive", "max_attempts": 3},
+    tcp_keepalive=True,
+)
+
+_MODEL_CACHE: dict[tuple[str, str], _CompactingBedrockModel] = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
+
+def _get_or_build_model(model_id: str, aws_region: str) -> _CompactingBedrockModel:
+    key = (model_id, aws_region)
+    with _MODEL_CACHE_LOCK:
+        model = _MODEL_CACHE.get(key)
+        if model is None:
+            cache_config = (
+                {"cache_prompt": "default", "cache_tools": "default"}
+                if _supports_prompt_caching(model_id, aws_region)
+                else {}
+            )
+            model = _CompactingBedrockModel(
+                model_id=model_id,
+                region_name=aws_region,
+                boto_client_config=_BOTO_CLIENT_CONFIG,
+                **cache_config,
+            )
+            _MODEL_CACHE[key] = model
+    return model
+
+
+# Upper bound on tool calls from one model turn that Strands runs concurrently
+MAX_PARALLEL_TOOLS = int(os.getenv("MAX_PARALLEL_TOOLS", "8"))
+
+# Maximum analyses running at once. /analyze answers 503 when all slots are taken.
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "4"))
+_agent_slots = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
 
 # Sentinel to signal the queue is done
 _DONE = object()
 
 
+def _sse(event: str, data: str) -> bytes:
+    return b"data: " + orjson.dumps({"event": event, "data": data}) + b"\n\n"
+
+
+# Status and tool events repeat the same few strings on every run
+_sse_cached = lru_cache(maxsize=64)(_sse)
+
+_STATUS_INIT = _sse("status", "Initializing analysis agent...")
+_STATUS_STARTED = _sse("status", "Agent started — cloning repository...")
+_STATUS_CACHED = _sse("status", "Serving cached analysis...")
+
+_CHUNK_PREFIX = b'data: {"event":"chunk","data":'
+
+
+def _sse_chunk(data: str) -> bytes:
+    """Same frame as _sse("chunk", data), but only the string needs encoding."""
+    return _CHUNK_PREFIX + orjson.dumps(data) + b"}\n\n"
+
+
+class _ChunkBatcher:
+    """
+    Coalesces consecutive chunk tokens into a single SSE frame. A batch is
+    flushed once it holds `max_chars` characters or `max_delay` seconds after
+    its first token, whichever comes first.
+    """
+
+    def __init__(self, max_chars: int = 512, max_delay: float = 0.025) -> None:
+        self._max_chars = max_chars
+        self._max_delay = max_delay
+        self._parts: list[str] = []
+        self._size = 0
+        self._deadline = 0.0
+
+    def __bool__(self) -> bool:
+        return bool(self._parts)
+
+    def add(self, text: str) -> None:
+        if not self._parts:
+            self._deadline = time.monotonic() + self._max_delay
+        self._parts.append(text)
+        self._size += len(text)
+
+    def due(self) -> bool:
+        """True if the pending batch should be flushed now."""
+        return bool(self._parts) and (
+            self._size >= self._max_chars or time.monotonic() >= self._deadline
+        )
+
+    def timeout(self) -> Optional[float]:
+        """Seconds until the pending batch is due, or None if nothing is buffered."""
+        if not self._parts:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def flush(self) -> str:
+        text = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        return text
+
+
 # ---------------------------------------------------------------------------
-# Callback handler — bridges Strands sync callbacks → async queue
+# Report cache — finished reports keyed by (url, branch, commit SHA, model)
 # ---------------------------------------------------------------------------
 
-class _StreamingHandler:
+REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", "3600"))  # seconds; 0 disables
+_REPORT_CACHE_MAX = 64
+_REPORT_CACHE: dict[tuple, tuple[float, str]] = {}
+
+# Size of the chunk events used when replaying a cached report
+_REPLAY_CHUNK_CHARS = 2048
+
+
+def get_cached_report(key: tuple) -> Optional[str]:
+    entry = _REPORT_CACHE.get(key)
+    if entry is None:
+        return None
+    expires, report = entry
+    if expires <= time.monotonic():
+        _REPORT_CACHE.pop(key, None)
+        return None
+    return report
+
+
+def _store_report(key: tuple, report: str) -> None:
+    if REPORT_CACHE_TTL <= 0:
+        return
+    _REPORT_CACHE.pop(key, None)
+    while len(_REPORT_CACHE) >= _REPORT_CACHE_MAX:
+        _REPORT_CACHE.pop(next(iter(_REPORT_CACHE)))  # evict oldest
+    _REPORT_CACHE[key] = (time.monotonic() + REPORT_CACHE_TTL, report)
+
+
+async def try_acquire_agent_slot() -> bool:
+    """
+    Take an analysis slot without waiting; False if all are in use.
+
+    Semaphore.acquire() does not suspend while the semaphore is unlocked, so no
+    other request can take the slot between the check and the acquire.
+    """
+    if _agent_slots.locked():
+        return False
+    await _agent_slots.acquire()
+    return True
+
+
+async def replay_report(report: str) -> AsyncIterator[bytes]:
     """
-    Passed to the Strands Agent as callback_handler.
-    Strands calls this as a function with keyword arguments.
-    Puts (event_type, data) tuples into a Queue so the async generator
-    can forward them to the SSE stream.
+    Yield a cached report as the same SSE event sequence a live analysis
+    produces, so the client cannot tell the difference.
+    """
+    yield _STATUS_CACHED
+    for i in range(0, len(report), _REPLAY_CHUNK_CHARS):
+        yield _sse_chunk(report[i:i + _REPLAY_CHUNK_CHARS])
+        await asyncio.sleep(0)
+    yield _sse("done", report)
+
+
+# ---------------------------------------------------------------------------
+# Agent runner — drives Strands' async stream
+# ---------------------------------------------------------------------------
 
-    Strands kwargs of interest:
+# Strong references to running agent tasks; the loop only keeps weak ones, and
+# an analysis continues after its client disconnects.
+_RUNNING: set[asyncio.Task] = set()
+
+
+def _to_event(event: dict) -> Optional[tuple[str, str]]:
+    """
+    Map a Strands stream event to an (event_type, data) SSE event, or None.
+
+    Strands event keys of interest:
       data              – streaming text token
       complete          – True when the current message turn is complete
       current_tool_use  – dict with 'name' and 'input' when a tool is invoked
       tool_result_message – present when a tool has returned
     """
+    # Streaming text token
+    data = event.get("data")
+    if data:
+        return "chunk", data
 
-    def __init__(self, q: Queue) -> None:
-        self._q = q
-
-    def __call__(self, **kwargs) -> None:
-        # Streaming text token
-        data = kwargs.get("data")
-        if data:
-            self._q.put(("chunk", data))
-            return
+    # Tool invocation
+    tool = event.get("current_tool_use")
+    if tool and isinstance(tool, dict) and not event.get("complete"):
+        return "tool_use", f"Running tool: {tool.get('name', 'tool')}"
 
-        # Tool invocation
-        tool = kwargs.get("current_tool_use")
-        if tool and isinstance(tool, dict) and not kwargs.get("complete"):
-            tool_name = tool.get("name", "tool")
-            self._q.put(("tool_use", f"Running tool: {tool_name}"))
-            return
+    # Tool result
+    if event.get("tool_result_message") is not None:
+        return "tool_result", "Tool completed"
+    return None
 
-        # Tool result
-        if kwargs.get("tool_result_message") is not None:
-            self._q.put(("tool_result", "Tool completed"))
 
-
-# ---------------------------------------------------------------------------
-# Blocking agent runner (executed in thread pool)
-# ---------------------------------------------------------------------------
-
-def _run_agent_sync(
+def _cloned_repository(messages: list) -> bool:
+    """
+    True if a clone_repository call in the conversation returned a repo_path.
+    A run without one produced a "could not clone" reply, not a report.
+    """
+    clone_ids = {
+        block["toolUse"].get("toolUseId")
+        for message in messages
+        for block in message.get("content", [])
+        if "toolUse" in block and block["toolUse"].get("name") == "clone_repository"
+    }
+    for message in messages:
+        for block in message.get("content", []):
+            result = block.get("toolResult")
+            if result is None or result.get("toolUseId") not in clone_ids:
+                continue
+            for item in result.get("content", []):
+                try:
+                    if "repo_path" in orjson.loads(item.get("text") or "{}"):
+                        return True
+                except (orjson.JSONDecodeError, TypeError):
+                    continue
+    return False
+
+
+async def _run_agent(
     model_id: str,
     aws_region: str,
     prompt: str,
-    q: Queue,
+    q: asyncio.Queue,
+    cache_key: Optional[tuple],
 ) -> str:
     """
-    Builds and runs the Strands agent synchronously.
-    Streaming tokens are pushed to `q` via the callback handler.
-    Returns the full result text as a string.
+    Builds and runs the Strands agent, pushing (event_type, data) tuples to `q`.
+    Returns the report text and, if `cache_key` is given, stores it for
+    get_cached_report — here rather than in the response generator, so a run
+    that outlives its client still lands in the cache. Only a run that
+    actually cloned the repository is cached; a transient clone failure must
+    not be replayed as a hit.
     """
-    model = BedrockModel(model_id=model_id, region_name=aws_region)
-    handler = _StreamingHandler(q)
-
+    # The model is shared; the Agent holds per-request conversation state.
+    # Building it (boto3 client, inference-profile lookup) blocks, so the
+    # first request for a model does that off the event loop.
+    model = await asyncio.to_thread(_get_or_build_model, model_id, aws_region)
     agent = Agent(
         model=model,
         tools=[
             clone_repository,
             list_repository_files,
             read_file_content,
+            read_files_batch,
             detect_tech_stack,
             cleanup_repository,
         ],
         system_prompt=SYSTEM_PROMPT,
-        callback_handler=handler,
+        callback_handler=None,
+        max_parallel_tools=MAX_PARALLEL_TOOLS,
+        load_tools_from_directory=False,
     )
 
-    result = agent(prompt)
-    return str(result)
+    collected: list[str] = []
+    async for event in agent.stream_async(prompt):
+        item = _to_event(event)
+        if item is not None:
+            if item[0] == "chunk":
+                collected.append(item[1])
+            q.put_nowait(item)
+
+    # If the model streamed tokens, collected already has the full text. If not
+    # (some Bedrock configs don't stream at token level), the agent's final
+    # message is the authoritative source.
+    if collected:
+        report = "".join(collected)
+    else:
+        final = agent.messages[-1] if agent.messages else {"content": []}
+        report = "".join(block.get("text", "") for block in final["content"])
+    if cache_key is not None and report and _cloned_repository(agent.messages):
+        _store_report(cache_key, report)
+    return report
 
 
 # ---------------------------------------------------------------------------
-# Public async generator
+# Public entry point
 # ---------------------------------------------------------------------------
 
-async def run_analysis(
+def run_analysis(
     gitlab_url: str,
     auth_type: str,
     credential: str,
     model_id: str,
     aws_region: str,
     branch: str = "main",
-) -> AsyncIterator[str]:
+    cache_key: Optional[tuple] = None,
+) -> AsyncIterator[bytes]:
     """
-    Run the modernization analysis and yield SSE-formatted strings.
+    Start the modernization analysis and return an async iterator of its
+    SSE-formatted, UTF-8 encoded frames.
     Each yielded value is a complete 'data: ...\\n\\n' SSE event.
-    """
-
-    def sse(event: str, data: str) -> str:
-        return f"data: {json.dumps({'event': event, 'data': data})}\n\n"
-
-    yield sse("status", "Initializing analysis agent...")
+    If `cache_key` is given, the final report is stored for get_cached_report.
 
+    The caller must hold an analysis slot (try_acquire_agent_slot). The agent
+    task is started here, before any frame is read, and owns the slot from
+    then on — so it is released even if the response is never streamed.
+    """
     prompt = (
         f"Please analyze the GitLab repository at: {gitlab_url}\n"
         f"Authentication type: {auth_type}\n"
@@ -187,56 +492,67 @@ async def run_analysis(
         "following the instructions in your system prompt. Clean up the repository when done."
     )
 
-    q: Queue = Queue()
-    loop = asyncio.get_event_loop()
-
-    # Submit the blocking agent call to the thread pool
-    future = loop.run_in_executor(
-        _executor,
-        _run_agent_sync,
-        model_id,
-        aws_region,
-        prompt,
-        q,
-    )
+    q: asyncio.Queue = asyncio.Queue()
 
-    yield sse("status", "Agent started — cloning repository...")
+    # The agent runs as its own task rather than inside the response generator:
+    # Strands' stream_async joins its worker thread when closed, which would
+    # block the event loop if a client disconnect cancelled it mid-run. The
+    # slot is held until the agent finishes.
+    future = asyncio.ensure_future(_run_agent(model_id, aws_region, prompt, q, cache_key))
+    _RUNNING.add(future)
 
-    # Drain the queue while the agent runs in the background thread
-    collected: list[str] = []
-    while not future.done():
-        # Non-blocking drain: pull up to 20 items then yield control
-        drained = 0
-        while drained < 20:
-            try:
-                event_type, data = q.get_nowait()
-                if event_type == "chunk":
-                    collected.append(data)
-                yield sse(event_type, data)
-                drained += 1
-            except Empty:
-                break
-        await asyncio.sleep(0.05)
+    def _on_done(_: asyncio.Future) -> None:
+        _RUNNING.discard(future)
+        if not future.cancelled():
+            future.exception()  # retrieved even if no client is left to await it
+        _agent_slots.release()
+        q.put_nowait(_DONE)  # after every event the agent queued
 
-    # Drain any remaining items after the future completes
-    while not q.empty():
+    future.add_done_callback(_on_done)
+    return _stream_events(q, future)
+
+
+async def _stream_events(q: asyncio.Queue, future: asyncio.Future) -> AsyncIterator[bytes]:
+    yield _STATUS_INIT
+    yield _STATUS_STARTED
+
+    # Forward events as they arrive while the agent runs.
+    # Chunk tokens are batched; tool events flush the batch so ordering is kept.
+    batcher = _ChunkBatcher()
+    done = False
+    while not done:
         try:
-            event_type, data = q.get_nowait()
+            item = await asyncio.wait_for(q.get(), batcher.timeout())
+        except asyncio.TimeoutError:
+            yield _sse_chunk(batcher.flush())
+            continue
+        # Take everything else already queued as well. If the client fell behind,
+        # the backlog goes out as a few merged frames rather than a lagging tail;
+        # non-chunk events are never dropped and keep their order.
+        items = [item]
+        while not q.empty():
+            items.append(q.get_nowait())
+        for item in items:
+            if item is _DONE:
+                done = True
+                break
+            event_type, data = item
             if event_type == "chunk":
-                collected.append(data)
-            yield sse(event_type, data)
-        except Empty:
-            break
+                batcher.add(data)
+                continue
+            if batcher:
+                yield _sse_chunk(batcher.flush())
+            yield _sse_cached(event_type, data)
+        if batcher.due():
+            yield _sse_chunk(batcher.flush())
+    if batcher:
+        yield _sse_chunk(batcher.flush())
 
     # Get the final result from the future
     try:
-        full_result = await future
+        final_text = await future
     except Exception as exc:
-        yield sse("error", f"Analysis failed: {exc}")
+        yield _sse("error", f"Analysis failed: {exc}")
         return
 
-    # If the model streamed tokens via on_llm_new_token, collected already has the
-    # full text. If not (some Bedrock configs don't stream at token level),
-    # full_result from the agent return value is the authoritative source.
-    final_text = "".join(collected) if collected else full_result
-    yield sse("done", final_text)
+    yield _sse("done", final_text)
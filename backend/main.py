@@ -4,13 +4,18 @@ Exposes a streaming SSE endpoint consumed by the Streamlit frontend.
 """
 import os
 import time
+import zlib
+from typing import Annotated, AsyncIterator
+
 import boto3
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
-from analyzer import run_analysis
+from analyzer import get_cached_report, replay_report, run_analysis, try_acquire_agent_slot
+from tools import resolve_remote_head
 
 # ---------------------------------------------------------------------------
 # Config from environment
@@ -44,16 +49,66 @@ app.add_middleware(
 # Request / response models
 # ---------------------------------------------------------------------------
 
+_NonEmptyStr = Annotated[str, Field(min_length=1)]
+
+# The URL reaches git as an argument, so only remote forms are accepted; a
+# leading "-" would be parsed as an option (--upload-pack=<command>)
+_GIT_URL_PATTERN = r"^(https://|ssh://|git@[^\s:/]+:)\S+$"
+
+
 class AnalyzeRequest(BaseModel):
-    gitlab_url: str = Field(..., description="Full GitLab repository URL")
-    auth_type: str = Field(..., description="'pat' or 'ssh'")
-    credential: str = Field(..., description="PAT string or SSH private key PEM")
-    branch: str = Field("main", description="Branch to analyze")
-    model_id: str = Field(
-        default="",
-        description="Bedrock model ID (empty = use server default)",
+    # Whitespace is stripped once here, so the route sees clean values.
+    # model_id may be empty (server default), so min_length is per field.
+    model_config = ConfigDict(
+        str_strip_whitespace=True,
+        extra="forbid",
+        protected_namespaces=(),
     )
 
+    gitlab_url: Annotated[
+        _NonEmptyStr,
+        Field(
+            pattern=_GIT_URL_PATTERN,
+            description="Full GitLab repository URL (https://, ssh:// or git@host:)",
+        ),
+    ]
+    auth_type: Annotated[str, Field(description="'pat' or 'ssh'")]
+    credential: Annotated[_NonEmptyStr, Field(description="PAT string or SSH private key PEM")]
+    branch: Annotated[_NonEmptyStr, Field(description="Branch to analyze")] = "main"
+    model_id: Annotated[str, Field(description="Bedrock model ID (empty = use server default)")] = ""
+
+
+# ---------------------------------------------------------------------------
+# SSE compression
+# ---------------------------------------------------------------------------
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """True if the Accept-Encoding header allows gzip (and doesn't set q=0)."""
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+async def _gzip_frames(frames: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Gzip an SSE byte stream frame by frame.
+
+    GZipMiddleware buffers its output, which would stall the stream. Here every
+    frame is followed by a Z_SYNC_FLUSH, so each one reaches the client (and can
+    be decoded) as soon as it is produced; the compression context is shared
+    across frames, so the large `done` event compresses against the chunks
+    that preceded it.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    try:
+        async for frame in frames:
+            yield compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        await frames.aclose()
+
 
 # ---------------------------------------------------------------------------
 # Routes
@@ -65,7 +120,7 @@ def health():
 
 
 @app.post("/analyze")
-async def analyze(request: AnalyzeRequest):
+async def analyze(request: AnalyzeRequest, http_request: Request):
     """
     Stream a modernization analysis as Server-Sent Events.
 
@@ -73,30 +128,57 @@ async def analyze(request: AnalyzeRequest):
       { "event": "status"|"chunk"|"tool_use"|"tool_result"|"done"|"error",
         "data": "<string>" }
     """
-    if not request.gitlab_url.strip():
-        raise HTTPException(status_code=400, detail="gitlab_url is required")
     if request.auth_type not in ("pat", "ssh"):
         raise HTTPException(status_code=400, detail="auth_type must be 'pat' or 'ssh'")
-    if not request.credential.strip():
-        raise HTTPException(status_code=400, detail="credential is required")
 
-    effective_model = request.model_id.strip() or DEFAULT_MODEL_ID
+    effective_model = request.model_id or DEFAULT_MODEL_ID
 
-    return StreamingResponse(
-        run_analysis(
+    # Reports are cached per commit. Resolving the head SHA with the caller's own
+    # credential also means a cache hit is only served to someone who can read the repo.
+    head_sha, remote_error = await run_in_threadpool(
+        resolve_remote_head,
+        request.gitlab_url,
+        request.auth_type,
+        request.credential,
+        request.branch,
+    )
+    # An unreachable, unauthorized or empty repo would only fail later inside
+    # the agent's clone step — reject it before any agent or Bedrock work starts.
+    if remote_error is not None:
+        raise HTTPException(status_code=400, detail=f"Cannot analyze repository: {remote_error}")
+    cache_key = (request.gitlab_url, request.branch, head_sha, effective_model) if head_sha else None
+    cached = get_cached_report(cache_key) if cache_key else None
+
+    if cached is not None:
+        events = replay_report(cached)
+    elif not await try_acquire_agent_slot():
+        raise HTTPException(
+            status_code=503,
+            detail="Too many analyses in progress, try again shortly",
+            headers={"Retry-After": "30"},
+        )
+    else:
+        events = run_analysis(
             gitlab_url=request.gitlab_url,
             auth_type=request.auth_type,
             credential=request.credential,
             model_id=effective_model,
             aws_region=AWS_REGION,
             branch=request.branch,
-        ),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",  # Disable nginx buffering if behind proxy
-        },
-    )
+            cache_key=cache_key,
+        )
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Disable nginx buffering if behind proxy
+        "X-Cache": "HIT" if cached is not None else "MISS",
+        "Vary": "Accept-Encoding",
+    }
+    if _accepts_gzip(http_request.headers.get("accept-encoding", "")):
+        events = _gzip_frames(events)
+        headers["Content-Encoding"] = "gzip"
+
+    return StreamingResponse(events, media_type="text/event-stream", headers=headers)
 
 
 _MODELS_CACHE: dict = {}
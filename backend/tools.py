@@ -1,24 +1,49 @@
 """
 Strands agent tools for GitLab repo cloning and code analysis.
 """
+import hashlib
+import json
 import os
+import re
 import stat
 import shutil
 import subprocess
 import tempfile
-import json
+import threading
+import time
+import uuid
+from itertools import islice
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
+
+import orjson
 from strands import tool
 
 
+def _dumps(obj) -> str:
+    """Encode a tool result; orjson is several times faster than json for file contents."""
+    try:
+        return orjson.dumps(obj).decode()
+    except TypeError:
+        # orjson rejects lone surrogates, which os.scandir uses for filenames
+        # that aren't valid UTF-8; json escapes them
+        return json.dumps(obj)
+
+
 # ---------------------------------------------------------------------------
 # Git helpers
 # ---------------------------------------------------------------------------
 
+# ssh only reads keys from files; on tmpfs the key never reaches a disk
+_KEY_DIR = "/dev/shm" if os.access("/dev/shm", os.W_OK) else None
+
+
 def _write_ssh_key(private_key: str) -> str:
     """Write SSH private key to a temp file; return path."""
-    fd, path = tempfile.mkstemp(prefix="gl_ssh_", suffix=".pem")
+    fd, path = tempfile.mkstemp(prefix="gl_ssh_", suffix=".pem", dir=_KEY_DIR)
     with os.fdopen(fd, "w") as f:
         key = private_key.strip()
         if not key.endswith("\n"):
@@ -28,17 +53,300 @@ def _write_ssh_key(private_key: str) -> str:
     return path
 
 
-def _run(cmd: list[str], env: Optional[dict] = None, cwd: Optional[str] = None) -> tuple[int, str, str]:
+def _ssh_command(key_path: str) -> str:
+    return (
+        f"ssh -i {key_path} -o BatchMode=yes"
+        " -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null"
+    )
+
+
+# Network git commands must fail on bad credentials, never wait on a prompt
+_GIT_NO_PROMPT = {"GIT_TERMINAL_PROMPT": "0"}
+
+
+def _pat_url(url: str, credential: str) -> Optional[str]:
+    """Inject PAT into HTTPS URL: https://oauth2:<token>@gitlab.com/..."""
+    if "://" not in url:
+        return None
+    proto, rest = url.split("://", 1)
+    return f"{proto}://oauth2:{credential}@{rest}"
+
+
+@contextmanager
+def _git_auth(url: str, auth_type: str, credential: str) -> Iterator[tuple[str, dict]]:
+    """
+    Yield the remote URL and environment for network git commands. A PAT goes
+    into the URL; an SSH key is written once and removed on exit, however
+    many commands run inside. Raises ValueError for an option-like URL or
+    unusable credentials.
+    """
+    if url.startswith("-"):
+        raise ValueError(f"Not a repository URL: {url}")
+    if auth_type == "pat":
+        authed_url = _pat_url(url, credential)
+        if authed_url is None:
+            raise ValueError(f"Cannot inject PAT into URL: {url}")
+        yield authed_url, _GIT_NO_PROMPT
+    elif auth_type == "ssh":
+        key_path = _write_ssh_key(credential)
+        try:
+            yield url, {**_GIT_NO_PROMPT, "GIT_SSH_COMMAND": _ssh_command(key_path)}
+        finally:
+            os.unlink(key_path)
+    else:
+        raise ValueError(f"Unknown auth_type: {auth_type}")
+
+
+def _run(
+    cmd: list[str],
+    env: Optional[dict] = None,
+    cwd: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> tuple[int, str, str]:
     result = subprocess.run(
         cmd,
         capture_output=True,
         text=True,
-        env={**os.environ, **(env or {})},
+        # None inherits our environment without building a copy of it
+        env={**os.environ, **env} if env else None,
         cwd=cwd,
+        timeout=timeout,
     )
     return result.returncode, result.stdout, result.stderr
 
 
+def _ls_remote(
+    remote_url: str,
+    env: dict,
+    credential: str,
+    branch: str,
+) -> tuple[Optional[dict[str, str]], Optional[str]]:
+    """
+    Look up HEAD and refs/heads/<branch> on the remote with `git ls-remote`.
+
+    Returns ({ref: sha}, None) on success, (None, error) if the remote rejected
+    the request, and (None, None) if the check itself could not be run.
+    """
+    refs = ["HEAD", f"refs/heads/{branch}"]
+    try:
+        # "--" so a URL starting with "-" can never be read as an option
+        rc, out, err = _run(["git", "ls-remote", "--", remote_url, *refs], env=env, timeout=30)
+    except Exception:
+        return None, None
+
+    if rc != 0:
+        # git may echo the URL, which carries the PAT
+        return None, err.strip().replace(credential, "***")
+    shas: dict[str, str] = {}
+    for line in out.splitlines():
+        sha, _, ref = line.partition("\t")
+        shas[ref] = sha
+    return shas, None
+
+
+def resolve_remote_head(
+    url: str,
+    auth_type: str,
+    credential: str,
+    branch: str = "main",
+) -> tuple[Optional[str], Optional[str]]:
+    """
+    Find the commit SHA that clone_repository would check out — the tip of
+    `branch`, or the remote HEAD if the branch does not exist — using a single
+    `git ls-remote` (no objects are transferred).
+
+    Returns (sha, None) on success, (None, error) if the remote is unreachable,
+    rejects the credential or has no commits, and (None, None) if the check
+    itself could not be run.
+    """
+    try:
+        with _git_auth(url, auth_type, credential) as (remote_url, env):
+            shas, error = _ls_remote(remote_url, env, credential, branch)
+    except ValueError as exc:
+        return None, str(exc)
+    except Exception:
+        return None, None
+    if shas is None:
+        return None, error
+    sha = shas.get(f"refs/heads/{branch}") or shas.get("HEAD")
+    if sha is None:
+        return None, "Repository has no commits to analyze"
+    return sha, None
+
+
+# ---------------------------------------------------------------------------
+# Clone cache — checkouts keyed by commit SHA, shared across analyses. Each
+# checkout is a worktree of a shallow bare mirror of its remote, so a new
+# commit of a repo seen before only fetches the objects that changed.
+# ---------------------------------------------------------------------------
+
+CLONE_CACHE_DIR = Path(
+    os.getenv("CLONE_CACHE_DIR", str(Path.home() / ".cache" / "modernize-analyzer" / "clones"))
+).absolute()
+CLONE_CACHE_MAX_BYTES = int(os.getenv("CLONE_CACHE_MAX_MB", "5120")) << 20
+
+# A checkout still referenced by an analysis is not evicted, unless it has sat
+# unused this long (the agent never called cleanup_repository).
+_CLONE_PIN_SECONDS = 3600
+
+_CLONE_LOCK = threading.Lock()
+_CLONE_REFS: dict[str, int] = {}   # sha -> analyses currently using the checkout
+_CLONE_SIZES: dict[str, int] = {}  # sha -> bytes on disk
+
+# Dot-prefixed, so the eviction scan never mistakes a mirror for a checkout.
+# Mirrors count toward CLONE_CACHE_MAX_BYTES; evicting a checkout gc's its
+# mirror, and a mirror is deleted once its last checkout has been evicted.
+_MIRROR_DIR = CLONE_CACHE_DIR / ".mirrors"
+_MIRROR_LOCKS: dict[str, threading.Lock] = {}  # mirror name -> lock around git ops on it
+_MIRROR_SIZES: dict[str, int] = {}  # mirror name -> bytes on disk
+
+# Deleting a checkout of tens of thousands of files takes seconds; paths are
+# renamed out of the way first and removed here, off the tool's critical path
+_CLEANUP_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cleanup")
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _acquire_cached_clone(sha: str) -> Optional[str]:
+    path = CLONE_CACHE_DIR / sha
+    with _CLONE_LOCK:
+        if not path.is_dir():
+            return None
+        _CLONE_REFS[sha] = _CLONE_REFS.get(sha, 0) + 1
+        os.utime(path)  # mtime is the LRU clock
+    return str(path)
+
+
+def _mirror_lock(name: str) -> threading.Lock:
+    with _CLONE_LOCK:
+        return _MIRROR_LOCKS.setdefault(name, threading.Lock())
+
+
+def _record_mirror_size(mirror: Path) -> None:
+    """Called with the mirror's lock held, after anything that changes it."""
+    size = _dir_size(str(mirror)) if mirror.is_dir() else None
+    with _CLONE_LOCK:
+        if size is None:
+            _MIRROR_SIZES.pop(mirror.name, None)
+        else:
+            _MIRROR_SIZES[mirror.name] = size
+
+
+def _reserve_cached_clone(sha: str) -> bool:
+    """
+    Pin `sha` for the caller before its checkout exists, so eviction cannot
+    remove it mid-creation. Returns True if the checkout is already there.
+    """
+    with _CLONE_LOCK:
+        _CLONE_REFS[sha] = _CLONE_REFS.get(sha, 0) + 1
+        return (CLONE_CACHE_DIR / sha).is_dir()
+
+
+def _register_cached_clone(sha: str) -> str:
+    """Record a new checkout's size and evict old entries to make room."""
+    path = CLONE_CACHE_DIR / sha
+    size = _dir_size(str(path))
+    with _CLONE_LOCK:
+        _CLONE_SIZES[sha] = size
+        os.utime(path)
+        victims = _pick_clone_evictions()
+    if victims:
+        _CLEANUP_POOL.submit(_delete_evicted, victims)
+    return str(path)
+
+
+def _delete_evicted(victims: list[str]) -> None:
+    """
+    Delete evicted checkouts, then any mirror left with no worktrees. A mirror
+    still in use is gc'd instead, dropping the objects only the evicted
+    checkouts needed; otherwise it would keep every commit ever fetched.
+    """
+    mirrors = set()
+    for victim in victims:
+        try:
+            # A worktree's .git file reads "gitdir: <mirror>/worktrees/<name>"
+            gitdir = Path(victim, ".git").read_text().split(":", 1)[1].strip()
+            mirrors.add(Path(gitdir).parent.parent)
+        except (OSError, IndexError):
+            pass  # a plain clone, nothing else to clean up
+        shutil.rmtree(victim, ignore_errors=True)
+
+    for mirror in mirrors:
+        lock = _mirror_lock(mirror.name)
+        if not lock.acquire(blocking=False):
+            continue  # being fetched into right now, so still wanted
+        try:
+            _run(["git", "-C", str(mirror), "worktree", "prune"])
+            worktrees = mirror / "worktrees"
+            if not worktrees.is_dir() or not any(worktrees.iterdir()):
+                shutil.rmtree(mirror, ignore_errors=True)
+            else:
+                # The remaining worktrees' HEADs are the only roots left
+                _run(["git", "-C", str(mirror), "gc", "--prune=now", "--quiet"])
+            _record_mirror_size(mirror)
+        finally:
+            lock.release()
+
+
+def _release_cached_clone(sha: str) -> None:
+    with _CLONE_LOCK:
+        refs = _CLONE_REFS.get(sha, 0) - 1
+        if refs > 0:
+            _CLONE_REFS[sha] = refs
+        else:
+            _CLONE_REFS.pop(sha, None)
+
+
+def _pick_clone_evictions() -> list[str]:
+    """
+    Called with _CLONE_LOCK held. Renames least-recently-used checkouts out of
+    the cache until it fits CLONE_CACHE_MAX_BYTES; returns the renamed paths
+    for the caller to delete outside the lock. Mirrors count toward the total
+    but shrink or go only through their checkouts' eviction.
+    """
+    mirrors_total = 0
+    if _MIRROR_DIR.is_dir():
+        for entry in os.scandir(_MIRROR_DIR):
+            size = _MIRROR_SIZES.get(entry.name)
+            if size is None:
+                size = _MIRROR_SIZES[entry.name] = _dir_size(entry.path)
+            mirrors_total += size
+
+    entries = []
+    for entry in os.scandir(CLONE_CACHE_DIR):
+        if entry.name.startswith(".") or not entry.is_dir(follow_symlinks=False):
+            continue  # in-flight clones and pending deletions
+        size = _CLONE_SIZES.get(entry.name)
+        if size is None:
+            size = _CLONE_SIZES[entry.name] = _dir_size(entry.path)
+        entries.append((entry.stat().st_mtime, entry.name, size))
+
+    total = mirrors_total + sum(size for _, _, size in entries)
+    now = time.time()
+    victims = []
+    for mtime, sha, size in sorted(entries):
+        if total <= CLONE_CACHE_MAX_BYTES:
+            break
+        if _CLONE_REFS.get(sha) and now - mtime < _CLONE_PIN_SECONDS:
+            continue
+        victim = str(CLONE_CACHE_DIR / f".evict_{sha}_{uuid.uuid4().hex}")
+        os.rename(CLONE_CACHE_DIR / sha, victim)
+        victims.append(victim)
+        total -= size
+        _CLONE_SIZES.pop(sha, None)
+        _CLONE_REFS.pop(sha, None)
+    return victims
+
+
 # ---------------------------------------------------------------------------
 # Tool: clone
 # ---------------------------------------------------------------------------
@@ -51,7 +359,9 @@ def clone_repository(
     branch: str = "main",
 ) -> str:
     """
-    Clone a GitLab repository to a temporary directory.
+    Clone a GitLab repository. If the same commit was cloned recently, the
+    cached checkout is returned without cloning again; a newer commit of a
+    repository cloned before only downloads what changed.
 
     Args:
         url: GitLab repository URL (HTTPS or SSH).
@@ -60,108 +370,296 @@ def clone_repository(
         branch: Branch to clone (default: main).
 
     Returns:
-        JSON string with 'repo_path' on success or 'error' on failure.
+        JSON string with 'repo_path' and 'commit' on success or 'error' on failure.
     """
-    dest = tempfile.mkdtemp(prefix="modernizer_repo_")
-
     try:
-        if auth_type == "pat":
-            # Inject PAT into HTTPS URL: https://oauth2:<token>@gitlab.com/...
-            if "://" in url:
-                proto, rest = url.split("://", 1)
-                authed_url = f"{proto}://oauth2:{credential}@{rest}"
-            else:
-                return json.dumps({"error": f"Cannot inject PAT into URL: {url}"})
-
-            rc, out, err = _run(
-                ["git", "clone", "--depth", "1", "--branch", branch, authed_url, dest]
-            )
-        elif auth_type == "ssh":
-            key_path = _write_ssh_key(credential)
+        # One key file (or PAT URL) serves both the ls-remote and the fetch
+        with _git_auth(url, auth_type, credential) as (remote_url, env):
+            return _dumps(_clone(url, remote_url, env, credential, branch))
+    except Exception as exc:
+        return _dumps({"error": str(exc)})
+
+
+def _clone(url: str, remote_url: str, env: dict, credential: str, branch: str) -> dict:
+    """clone_repository, run with the remote's credentials in place."""
+    shas, remote_error = _ls_remote(remote_url, env, credential, branch)
+    if remote_error is not None:
+        return {"error": remote_error}
+    sha = None
+    if shas is not None:
+        sha = shas.get(f"refs/heads/{branch}") or shas.get("HEAD")
+        if sha is None:
+            return {"error": "Repository has no commits to analyze"}
+        cached = _acquire_cached_clone(sha)
+        if cached is not None:
+            return {"repo_path": cached, "commit": sha}
+
+    # ls-remote already told us whether the branch exists, so a missing branch
+    # fetches the default branch straight away. Only when that check could not
+    # run do we fall back to trying the branch and retrying without it.
+    if shas is None:
+        fetch_refs = [f"refs/heads/{branch}", "HEAD"]
+    elif f"refs/heads/{branch}" in shas:
+        fetch_refs = [f"refs/heads/{branch}"]
+    else:
+        fetch_refs = ["HEAD"]
+
+    mirror_name = hashlib.sha1(url.encode()).hexdigest()
+    mirror = _MIRROR_DIR / mirror_name
+    reserved = None
+    try:
+        with _mirror_lock(mirror_name):
             try:
-                ssh_cmd = (
-                    f"ssh -i {key_path} -o StrictHostKeyChecking=no "
-                    f"-o UserKnownHostsFile=/dev/null"
-                )
+                new_mirror = not (mirror / "HEAD").exists()
+                if new_mirror:
+                    mirror.mkdir(parents=True, exist_ok=True)
+                    _run(["git", "init", "--bare", "-q", str(mirror)])
+                    # Check symlinks out as small text files holding their target,
+                    # so nothing in a cached checkout points outside it
+                    _run(["git", "-C", str(mirror), "config", "core.symlinks", "false"])
+
+                # The URL is passed per fetch and never stored, so the PAT stays
+                # off disk. Only the one commit is needed: depth 1, no tag refs.
+                # "--" keeps the URL from ever being read as an option.
+                for ref in fetch_refs:
+                    rc, out, err = _run(
+                        ["git", "-C", str(mirror), "fetch", "--depth", "1", "--no-tags",
+                         "--", remote_url, ref],
+                        env=env,
+                    )
+                    if rc == 0:
+                        break
+                if rc != 0:
+                    if new_mirror:
+                        shutil.rmtree(mirror, ignore_errors=True)
+                    return {"error": err.strip().replace(credential, "***")}
+
+                rc, out, err = _run(["git", "-C", str(mirror), "rev-parse", "FETCH_HEAD"])
+                if rc != 0:
+                    return {"error": err.strip()}
+                sha = out.strip()
+                if _reserve_cached_clone(sha):
+                    # Cached after all; the reservation is the caller's reference
+                    return {"repo_path": str(CLONE_CACHE_DIR / sha), "commit": sha}
+                reserved = sha
+
+                dest = str(CLONE_CACHE_DIR / sha)
+                _run(["git", "-C", str(mirror), "worktree", "prune"])
                 rc, out, err = _run(
-                    ["git", "clone", "--depth", "1", "--branch", branch, url, dest],
-                    env={"GIT_SSH_COMMAND": ssh_cmd},
+                    ["git", "-C", str(mirror), "worktree", "add", "--detach", "-q", dest, sha]
                 )
             finally:
-                os.unlink(key_path)
-        else:
-            return json.dumps({"error": f"Unknown auth_type: {auth_type}"})
-
-        if rc != 0:
-            # Try without branch in case default branch differs
-            if auth_type == "pat":
-                rc, out, err = _run(["git", "clone", "--depth", "1", authed_url, dest])
-            else:
-                rc, out, err = _run(
-                    ["git", "clone", "--depth", "1", url, dest],
-                    env={"GIT_SSH_COMMAND": ssh_cmd},
-                )
-
-        if rc != 0:
+                # Fetches and worktree changes all change its size
+                _record_mirror_size(mirror)
+        if rc != 0 and not os.path.exists(os.path.join(dest, ".git")):
+            # (another remote with the same commit may have won the race)
             shutil.rmtree(dest, ignore_errors=True)
-            return json.dumps({"error": err.strip()})
+            return {"error": err.strip()}
 
-        return json.dumps({"repo_path": dest})
-
-    except Exception as exc:
-        shutil.rmtree(dest, ignore_errors=True)
-        return json.dumps({"error": str(exc)})
+        reserved = None
+        return {"repo_path": _register_cached_clone(sha), "commit": sha}
+    finally:
+        if reserved is not None:
+            _release_cached_clone(reserved)
 
 
 # ---------------------------------------------------------------------------
 # Tool: list files
 # ---------------------------------------------------------------------------
 
+_SKIP_DIRS = frozenset({
+    ".git", "node_modules", "__pycache__", ".venv", "venv",
+    "dist", "build", ".next", ".nuxt", "vendor", "target",
+    "bin", "obj", ".gradle", ".mvn",
+})
+_SKIP_EXTS = frozenset({
+    ".png", ".jpg", ".jpeg", ".gif", ".ico", ".svg", ".woff",
+    ".woff2", ".ttf", ".eot", ".mp4", ".mp3", ".zip", ".tar",
+    ".gz", ".lock",
+})
+
+
+def _walk(root: str, skip_dirs: frozenset[str], skip_exts: frozenset[str]) -> Iterator[str]:
+    """
+    Yield the relative paths of regular files under root, depth first.
+
+    Directories named in skip_dirs are pruned before they are read, and entry
+    types come from readdir's d_type, so most entries cost no stat call. The
+    walk is lazy: it stops reading directories as soon as the caller stops.
+    """
+    stack = [("", root)]
+    while stack:
+        prefix, path = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in skip_dirs:
+                            subdirs.append((prefix + entry.name + os.sep, entry.path))
+                    elif entry.is_file(follow_symlinks=False):
+                        if os.path.splitext(entry.name)[1].lower() not in skip_exts:
+                            yield prefix + entry.name
+        except OSError:
+            continue
+        stack.extend(reversed(subdirs))
+
+
+def _git_files(repo_path: str) -> Optional[Iterator[str]]:
+    """
+    Tracked files of a git checkout, read from its index with `git ls-files`
+    (no directory walk), filtered like _walk. None if repo_path is not a
+    checkout root or git fails, so the caller can walk the tree instead.
+    """
+    if not os.path.exists(os.path.join(repo_path, ".git")):
+        return None
+    try:
+        # Bytes mode: one tracked path that isn't valid UTF-8 must not cost the
+        # whole listing, so each path is decoded on its own
+        result = subprocess.run(
+            ["git", "-C", repo_path, "ls-files", "-z"], capture_output=True
+        )
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return (
+        rel_path
+        for rel_path in (raw.decode("utf-8", "replace") for raw in result.stdout.split(b"\0"))
+        if rel_path
+        and os.path.splitext(rel_path)[1].lower() not in _SKIP_EXTS
+        and not any(part in _SKIP_DIRS for part in rel_path.split("/")[:-1])
+    )
+
+
 @tool
 def list_repository_files(repo_path: str, max_files: int = 300) -> str:
     """
     Return a recursive listing of all files in the repository, excluding
-    .git and common binary/generated directories.
+    .git and common binary/generated directories. For a git checkout this
+    is the tracked files.
 
     Args:
         repo_path: Absolute path to the cloned repo.
         max_files: Maximum number of files to return.
 
     Returns:
-        JSON list of relative file paths.
+        JSON with 'files' (relative paths), 'total', and 'truncated' (true if
+        the repository has more files than max_files).
     """
-    skip_dirs = {
-        ".git", "node_modules", "__pycache__", ".venv", "venv",
-        "dist", "build", ".next", ".nuxt", "vendor", "target",
-        "bin", "obj", ".gradle", ".mvn",
-    }
-    skip_exts = {
-        ".png", ".jpg", ".jpeg", ".gif", ".ico", ".svg", ".woff",
-        ".woff2", ".ttf", ".eot", ".mp4", ".mp3", ".zip", ".tar",
-        ".gz", ".lock",
-    }
-
-    files: list[str] = []
-    root = Path(repo_path)
+    paths = _git_files(repo_path)
+    if paths is None:
+        paths = _walk(repo_path, _SKIP_DIRS, _SKIP_EXTS)
+    # Pull one extra path to tell a full listing from a truncated one; the
+    # walk reads no further directories once islice stops pulling.
+    files = list(islice(paths, max(max_files, 0) + 1))
+    truncated = len(files) > max_files
+    del files[max_files:]
 
-    for p in root.rglob("*"):
-        if p.is_file():
-            parts = set(p.relative_to(root).parts)
-            if parts & skip_dirs:
-                continue
-            if p.suffix.lower() in skip_exts:
-                continue
-            files.append(str(p.relative_to(root)))
-            if len(files) >= max_files:
-                break
-
-    return json.dumps({"files": files, "total": len(files)})
+    return _dumps({"files": files, "total": len(files), "truncated": truncated})
 
 
 # ---------------------------------------------------------------------------
 # Tool: read file
 # ---------------------------------------------------------------------------
 
+# File reads are I/O-bound, so a batch is fanned out over a small pool
+_READ_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="read_file")
+
+
+# Results of recent reads, keyed by (path, mtime_ns, size, max_lines) so an
+# edited file is never served stale. Bounded by total content size.
+_READ_CACHE_MAX_BYTES = 128 << 20
+_READ_CACHE: OrderedDict[tuple, dict] = OrderedDict()
+_READ_CACHE_BYTES = 0
+_READ_CACHE_LOCK = threading.Lock()
+
+# A NUL byte in the first block means binary content, not worth a model turn
+_BINARY_SNIFF_BYTES = 8192
+# Extensions that are always binary are refused before touching the disk
+_BINARY_EXTS = frozenset({
+    ".png", ".jpg", ".jpeg", ".gif", ".ico", ".bmp", ".webp", ".pdf",
+    ".woff", ".woff2", ".ttf", ".eot", ".mp4", ".mp3", ".zip", ".tar",
+    ".gz", ".tgz", ".bz2", ".xz", ".7z", ".jar", ".war", ".class",
+    ".exe", ".dll", ".so", ".dylib", ".o", ".a", ".pyc",
+})
+# Only the first max_lines are returned, so at most this many bytes per
+# requested line are read; a 50 MB log costs the same as a short file.
+_READ_BYTES_PER_LINE = 1024
+# One read_files_batch result must fit comfortably in the model's context:
+# at most this many files, and once the contents returned pass the character
+# budget, the remaining paths are listed as skipped instead of read
+_BATCH_MAX_FILES = 20
+_BATCH_MAX_CHARS = 200_000
+
+
+def _read_file(repo_path: str, relative_path: str, max_lines: int) -> dict:
+    global _READ_CACHE_BYTES
+
+    # Path traversal guard: a lexical check needs no filesystem access
+    repo_abs = os.path.abspath(repo_path)
+    target = os.path.normpath(os.path.join(repo_abs, relative_path))
+    if not target.startswith(repo_abs + os.sep):
+        return {"error": "Path traversal detected"}
+    # Cached checkouts contain no symlinks; anything else may link outside itself
+    if os.path.dirname(repo_abs) != str(CLONE_CACHE_DIR):
+        real_root = os.path.realpath(repo_abs)
+        if not os.path.realpath(target).startswith(real_root + os.sep):
+            return {"error": "Path traversal detected"}
+    if os.path.splitext(target)[1].lower() in _BINARY_EXTS:
+        return {"error": f"Binary file, not shown: {relative_path}"}
+
+    try:
+        st = os.stat(target)
+    except FileNotFoundError:
+        return {"error": f"File not found: {relative_path}"}
+    except OSError as exc:
+        return {"error": str(exc)}
+    if not stat.S_ISREG(st.st_mode):
+        return {"error": f"Not a file: {relative_path}"}
+
+    key = (target, st.st_mtime_ns, st.st_size, max_lines)
+    with _READ_CACHE_LOCK:
+        result = _READ_CACHE.get(key)
+        if result is not None:
+            _READ_CACHE.move_to_end(key)
+            return result
+
+    result = _read_text_file(target, relative_path, max_lines, st.st_size)
+    if "content" in result:
+        size = len(result["content"])
+        with _READ_CACHE_LOCK:
+            if key not in _READ_CACHE:
+                _READ_CACHE[key] = result
+                _READ_CACHE_BYTES += size
+            while _READ_CACHE_BYTES > _READ_CACHE_MAX_BYTES:
+                _, evicted = _READ_CACHE.popitem(last=False)
+                _READ_CACHE_BYTES -= len(evicted["content"])
+    return result
+
+
+def _read_text_file(target: str, relative_path: str, max_lines: int, size: int) -> dict:
+    budget = max(max_lines, 1) * _READ_BYTES_PER_LINE
+    try:
+        with open(target, "rb") as f:
+            data = f.read(budget + 1)
+        if b"\0" in data[:_BINARY_SNIFF_BYTES]:
+            return {"error": f"Binary file, not shown: {relative_path}"}
+        partial = len(data) > budget
+        lines = data[:budget].decode("utf-8", errors="replace").splitlines()
+        result = {
+            "content": "\n".join(lines[:max_lines]),
+            "lines_shown": min(len(lines), max_lines),
+            "total_bytes": size,
+            "truncated": partial or len(lines) > max_lines,
+        }
+        if not partial:
+            result["total_lines"] = len(lines)  # only known when the whole file was read
+        return result
+    except Exception as exc:
+        return {"error": str(exc)}
+
+
 @tool
 def read_file_content(repo_path: str, relative_path: str, max_lines: int = 300) -> str:
     """
@@ -175,35 +673,61 @@ def read_file_content(repo_path: str, relative_path: str, max_lines: int = 300)
     Returns:
         JSON with 'content' field or 'error'.
     """
-    target = Path(repo_path) / relative_path
-    try:
-        target.resolve().relative_to(Path(repo_path).resolve())  # path traversal guard
-    except ValueError:
-        return json.dumps({"error": "Path traversal detected"})
+    return _dumps(_read_file(repo_path, relative_path, max_lines))
 
-    if not target.exists():
-        return json.dumps({"error": f"File not found: {relative_path}"})
-    if not target.is_file():
-        return json.dumps({"error": f"Not a file: {relative_path}"})
 
-    try:
-        lines = target.read_text(errors="replace").splitlines()
-        truncated = len(lines) > max_lines
-        content = "\n".join(lines[:max_lines])
-        return json.dumps({
-            "content": content,
-            "lines_shown": min(len(lines), max_lines),
-            "total_lines": len(lines),
-            "truncated": truncated,
-        })
-    except Exception as exc:
-        return json.dumps({"error": str(exc)})
+@tool
+def read_files_batch(repo_path: str, relative_paths: list[str], max_lines: int = 300) -> str:
+    """
+    Read several files within the repository in one call. Prefer this over
+    repeated read_file_content calls when you already know which files you need.
+
+    Args:
+        repo_path: Absolute path to the cloned repo.
+        relative_paths: Relative paths of the files within the repo.
+        max_lines: Maximum lines to return per file (truncates long files).
+
+    Returns:
+        JSON with a 'files' dict mapping each path to its read_file_content
+        result, and 'skipped' listing the paths not read because the batch
+        limit (20 files, or 200,000 characters of content) was reached;
+        request those in another call.
+    """
+    paths = list(dict.fromkeys(relative_paths))
+    files = {}
+    skipped = []
+    chars = 0
+    reads = _READ_POOL.map(
+        lambda rel: _read_file(repo_path, rel, max_lines), paths[:_BATCH_MAX_FILES]
+    )
+    for rel, result in zip(paths, reads):
+        size = len(result.get("content", ""))
+        # The first file is always returned, as read_file_content would
+        if files and chars + size > _BATCH_MAX_CHARS:
+            skipped.append(rel)
+        else:
+            files[rel] = result
+            chars += size
+    skipped.extend(paths[_BATCH_MAX_FILES:])
+    return _dumps({"files": files, "skipped": skipped})
 
 
 # ---------------------------------------------------------------------------
 # Tool: detect tech stack
 # ---------------------------------------------------------------------------
 
+# Scan results depend only on the commit, so they are kept per SHA in memory
+# and on disk (shared by workers and across restarts). By default the disk
+# cache sits next to the clone cache, under the same configurable root.
+TECH_STACK_CACHE_DIR = Path(
+    os.getenv("TECH_STACK_CACHE_DIR", str(CLONE_CACHE_DIR.parent / "tech_stack"))
+).absolute()
+_TECH_STACK_CACHE_MAX = 256
+_TECH_STACK_CACHE: dict[str, str] = {}  # sha -> detect_tech_stack JSON
+# Parallel tool calls from several agents read, evict and write concurrently
+_TECH_STACK_LOCK = threading.Lock()
+
+
 @tool
 def detect_tech_stack(repo_path: str) -> str:
     """
@@ -216,6 +740,116 @@ def detect_tech_stack(repo_path: str) -> str:
     Returns:
         JSON dict with detected stack information.
     """
+    path = Path(repo_path).absolute()
+    if path.parent == CLONE_CACHE_DIR:
+        sha = path.name  # cached checkouts are named after their commit
+    else:
+        rc, out = 1, ""
+        if (path / ".git").exists():
+            rc, out, _ = _run(["git", "-C", repo_path, "rev-parse", "HEAD"])
+        if rc != 0:
+            return _dumps(_scan_tech_stack(repo_path))  # not a checkout root
+        sha = out.strip()
+
+    with _TECH_STACK_LOCK:
+        cached = _TECH_STACK_CACHE.get(sha)
+    if cached is not None:
+        return cached
+
+    cache_file = TECH_STACK_CACHE_DIR / f"{sha}.json"
+    try:
+        result = cache_file.read_text()
+    except OSError:
+        result = _dumps(_scan_tech_stack(repo_path))
+        try:
+            TECH_STACK_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = cache_file.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            tmp.write_text(result)
+            os.replace(tmp, cache_file)
+        except OSError:
+            pass
+
+    with _TECH_STACK_LOCK:
+        _TECH_STACK_CACHE.pop(sha, None)
+        while len(_TECH_STACK_CACHE) >= _TECH_STACK_CACHE_MAX:
+            _TECH_STACK_CACHE.pop(next(iter(_TECH_STACK_CACHE)))  # evict oldest
+        _TECH_STACK_CACHE[sha] = result
+    return result
+
+
+# Root-relative paths whose presence adds a label to a stack category, in
+# report order. Directory signals match when any file lies beneath them.
+_STACK_SIGNALS: tuple[tuple[str, str, str], ...] = (
+    # (path, category, label)
+    ("package.json", "manifest_files", "package.json"),
+    ("requirements.txt", "manifest_files", "requirements.txt"),
+    ("requirements-dev.txt", "manifest_files", "requirements-dev.txt"),
+    ("pyproject.toml", "manifest_files", "pyproject.toml"),
+    ("Pipfile", "manifest_files", "Pipfile"),
+    ("pom.xml", "manifest_files", "pom.xml"),
+    ("build.gradle", "manifest_files", "build.gradle"),
+    ("go.mod", "manifest_files", "go.mod"),
+    ("Gemfile", "manifest_files", "Gemfile"),
+    ("composer.json", "manifest_files", "composer.json"),
+    ("Cargo.toml", "manifest_files", "Cargo.toml"),
+    ("setup.py", "manifest_files", "setup.py"),
+    ("setup.cfg", "manifest_files", "setup.cfg"),
+    (".gitlab-ci.yml", "ci_cd", ".gitlab-ci.yml"),
+    (".github/workflows", "ci_cd", ".github/workflows"),
+    ("Jenkinsfile", "ci_cd", "Jenkinsfile"),
+    (".circleci/config.yml", "ci_cd", ".circleci/config.yml"),
+    ("azure-pipelines.yml", "ci_cd", "azure-pipelines.yml"),
+    ("bitbucket-pipelines.yml", "ci_cd", "bitbucket-pipelines.yml"),
+    ("Dockerfile", "containerization", "Dockerfile"),
+    ("docker-compose.yml", "containerization", "docker-compose.yml"),
+    ("docker-compose.yaml", "containerization", "docker-compose.yaml"),
+    ("kubernetes", "containerization", "kubernetes"),
+    ("k8s", "containerization", "k8s"),
+    ("helm", "containerization", "helm"),
+    (".helm", "containerization", ".helm"),
+    ("pom.xml", "build_tools", "Maven"),
+    ("build.gradle", "build_tools", "Gradle"),
+    ("Makefile", "build_tools", "Make"),
+    ("package-lock.json", "build_tools", "npm"),
+    ("yarn.lock", "build_tools", "yarn"),
+    ("pnpm-lock.yaml", "build_tools", "pnpm"),
+    ("pyproject.toml", "build_tools", "Poetry"),
+)
+_SIGNAL_DIRS = (".github/workflows", "kubernetes", "k8s", "helm", ".helm")
+_SIGNAL_FILES = frozenset(path for path, _, _ in _STACK_SIGNALS) - frozenset(_SIGNAL_DIRS)
+_SIGNAL_DIR_PREFIXES = tuple(d + os.sep for d in _SIGNAL_DIRS)
+
+# Language detection by file extension presence
+_EXT_LANG_MAP = {
+    ".py": "Python", ".js": "JavaScript", ".mjs": "JavaScript",
+    ".ts": "TypeScript", ".tsx": "TypeScript", ".java": "Java",
+    ".go": "Go", ".rb": "Ruby", ".php": "PHP",
+    ".cs": "C#", ".rs": "Rust",
+}
+_JS_FRAMEWORKS = ("react", "vue", "angular", "@angular/core", "svelte",
+                  "next", "nuxt", "express", "koa", "fastify")
+# package.json dependency name (bare or @-scoped) -> framework label
+_JS_FRAMEWORK_DEPS = {
+    dep: fw.replace("@angular/core", "Angular").replace("@", "").title()
+    for fw in _JS_FRAMEWORKS
+    for dep in (fw, f"@{fw}")
+}
+# A requirement line naming the package, e.g. "Django>=4", "flask_cors", "fastapi[all]"
+_PY_FRAMEWORK_RE = re.compile(r"(?im)^\s*(django|flask|fastapi|tornado|pyramid|falcon)(?![a-z0-9])")
+# The stack scan looks past vendored dirs too, only .git is skipped
+_SCAN_SKIP_DIRS: frozenset[str] = frozenset({".git"})
+_SCAN_SKIP_EXTS: frozenset[str] = frozenset()
+
+
+def _read_text_safe(path: Path) -> str:
+    """Read a small text file, returning "" if it is missing or unreadable."""
+    try:
+        return path.read_text()
+    except (OSError, UnicodeDecodeError):
+        return ""
+
+
+def _scan_tech_stack(repo_path: str) -> dict:
     root = Path(repo_path)
     stack: dict = {
         "languages": [],
@@ -227,113 +861,49 @@ def detect_tech_stack(repo_path: str) -> str:
         "manifest_files": [],
     }
 
-    checks = {
-        # Language signals
-        "languages": {
-            "Python": ["*.py", "requirements*.txt", "setup.py", "pyproject.toml", "Pipfile"],
-            "JavaScript": ["*.js", "*.mjs", "package.json"],
-            "TypeScript": ["*.ts", "*.tsx", "tsconfig.json"],
-            "Java": ["*.java", "pom.xml", "build.gradle"],
-            "Go": ["*.go", "go.mod"],
-            "Ruby": ["*.rb", "Gemfile"],
-            "PHP": ["*.php", "composer.json"],
-            "C#": ["*.cs", "*.csproj"],
-            "Rust": ["*.rs", "Cargo.toml"],
-        },
-        "frameworks": {
-            "React": ["package.json"],
-            "Vue": ["package.json"],
-            "Angular": ["angular.json"],
-            "Django": ["manage.py", "django"],
-            "Flask": ["app.py", "wsgi.py"],
-            "FastAPI": ["requirements*.txt"],
-            "Spring Boot": ["pom.xml", "build.gradle"],
-            "Next.js": ["next.config.js", "next.config.ts"],
-            "Express": ["package.json"],
-        },
-    }
-
-    manifest_names = [
-        "package.json", "requirements.txt", "requirements-dev.txt",
-        "pyproject.toml", "Pipfile", "pom.xml", "build.gradle",
-        "go.mod", "Gemfile", "composer.json", "Cargo.toml",
-        "setup.py", "setup.cfg",
-    ]
-    ci_names = [
-        ".gitlab-ci.yml", ".github/workflows", "Jenkinsfile",
-        ".circleci/config.yml", "azure-pipelines.yml", "bitbucket-pipelines.yml",
-    ]
-    container_names = ["Dockerfile", "docker-compose.yml", "docker-compose.yaml",
-                       "kubernetes", "k8s", "helm", ".helm"]
-
-    found_manifests = []
-    for name in manifest_names:
-        if (root / name).exists():
-            found_manifests.append(name)
-    stack["manifest_files"] = found_manifests
-
-    # Language detection by file extension presence
-    ext_lang_map = {
-        ".py": "Python", ".js": "JavaScript", ".mjs": "JavaScript",
-        ".ts": "TypeScript", ".tsx": "TypeScript", ".java": "Java",
-        ".go": "Go", ".rb": "Ruby", ".php": "PHP",
-        ".cs": "C#", ".rs": "Rust",
-    }
+    # One walk collects extensions, signal paths and root requirements files
     found_exts: set[str] = set()
-    for p in root.rglob("*"):
-        if p.is_file() and ".git" not in p.parts:
-            found_exts.add(p.suffix.lower())
-    for ext, lang in ext_lang_map.items():
-        if ext in found_exts and lang not in stack["languages"]:
-            stack["languages"].append(lang)
+    found_paths: set[str] = set()
+    req_files: list[str] = []
+    for rel_path in _walk(repo_path, _SCAN_SKIP_DIRS, _SCAN_SKIP_EXTS):
+        found_exts.add(os.path.splitext(rel_path)[1].lower())
+        if rel_path in _SIGNAL_FILES:
+            found_paths.add(rel_path)
+        elif rel_path.startswith(_SIGNAL_DIR_PREFIXES):
+            found_paths.update(d for d in _SIGNAL_DIRS if rel_path.startswith(d + os.sep))
+        if (os.sep not in rel_path and rel_path.startswith("requirements")
+                and rel_path.endswith(".txt")):
+            req_files.append(rel_path)
+    for path, category, label in _STACK_SIGNALS:
+        if path in found_paths:
+            stack[category].append(label)
+    languages = {_EXT_LANG_MAP[ext] for ext in found_exts if ext in _EXT_LANG_MAP}
+    frameworks: set[str] = set()
+
+    # The manifests are independent small reads, so they go out concurrently
+    manifests = sorted(req_files)
+    if "package.json" in found_paths:
+        manifests.append("package.json")
+    contents = dict(zip(manifests, _READ_POOL.map(_read_text_safe, [root / m for m in manifests])))
 
     # Framework signals from package.json
-    pkg_json = root / "package.json"
-    if pkg_json.exists():
+    if "package.json" in found_paths:
         try:
-            pkg = json.loads(pkg_json.read_text())
+            pkg = orjson.loads(contents["package.json"])
             deps = {**pkg.get("dependencies", {}), **pkg.get("devDependencies", {})}
-            for fw in ["react", "vue", "angular", "@angular/core", "svelte",
-                       "next", "nuxt", "express", "koa", "fastify"]:
-                if fw in deps or f"@{fw}" in deps:
-                    label = fw.replace("@angular/core", "Angular").replace("@", "").title()
-                    if label not in stack["frameworks"]:
-                        stack["frameworks"].append(label)
+            frameworks.update(
+                _JS_FRAMEWORK_DEPS[dep] for dep in deps if dep in _JS_FRAMEWORK_DEPS
+            )
         except Exception:
             pass
 
     # Python framework signals
-    for req_file in root.glob("requirements*.txt"):
-        try:
-            content = req_file.read_text().lower()
-            for fw in ["django", "flask", "fastapi", "tornado", "pyramid", "falcon"]:
-                if fw in content and fw.title() not in stack["frameworks"]:
-                    stack["frameworks"].append(fw.title())
-        except Exception:
-            pass
+    for req_file in req_files:
+        frameworks.update(m.title() for m in _PY_FRAMEWORK_RE.findall(contents[req_file]))
 
-    # CI/CD
-    for name in ci_names:
-        if (root / name).exists():
-            stack["ci_cd"].append(name)
-
-    # Containerization
-    for name in container_names:
-        if (root / name).exists():
-            stack["containerization"].append(name)
-
-    # Build tools
-    build_signals = {
-        "Maven": "pom.xml", "Gradle": "build.gradle",
-        "Make": "Makefile", "npm": "package-lock.json",
-        "yarn": "yarn.lock", "pnpm": "pnpm-lock.yaml",
-        "Poetry": "pyproject.toml",
-    }
-    for tool_name, fname in build_signals.items():
-        if (root / fname).exists():
-            stack["build_tools"].append(tool_name)
-
-    return json.dumps(stack)
+    stack["languages"] = sorted(languages)
+    stack["frameworks"] = sorted(frameworks)
+    return stack
 
 
 # ---------------------------------------------------------------------------
@@ -343,7 +913,8 @@ def detect_tech_stack(repo_path: str) -> str:
 @tool
 def cleanup_repository(repo_path: str) -> str:
     """
-    Delete a cloned repository from disk after analysis is complete.
+    Release a cloned repository after analysis is complete. Cached checkouts
+    are kept for reuse; anything else is deleted from disk.
 
     Args:
         repo_path: Absolute path to the cloned repo.
@@ -351,8 +922,22 @@ def cleanup_repository(repo_path: str) -> str:
     Returns:
         JSON with 'status'.
     """
+    path = Path(repo_path).absolute()
+    if path.parent == CLONE_CACHE_DIR:
+        _release_cached_clone(path.name)
+        return _dumps({"status": "released", "path": repo_path})
     try:
-        shutil.rmtree(repo_path, ignore_errors=True)
-        return json.dumps({"status": "deleted", "path": repo_path})
+        # Renaming within the parent directory is atomic and never crosses a
+        # filesystem; the slow recursive delete then happens in the background
+        trash = path.with_name(f".trash_{path.name}_{uuid.uuid4().hex}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            shutil.rmtree(repo_path, ignore_errors=True)
+        else:
+            _CLEANUP_POOL.submit(shutil.rmtree, trash, ignore_errors=True)
+        return _dumps({"status": "deleted", "path": repo_path})
     except Exception as exc:
-        return json.dumps({"status": "error", "error": str(exc)})
+        return _dumps({"status": "error", "error": str(exc)})
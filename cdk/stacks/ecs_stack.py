@@ -63,6 +63,13 @@ class EcsStack(Stack):
                 resources=["*"],  # Narrow to specific model ARNs if desired
             )
         )
+        # Resolve application inference profiles to their model (prompt caching support)
+        backend_task_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["bedrock:GetInferenceProfile"],
+                resources=["*"],
+            )
+        )
 
         # ------------------------------------------------------------------ #
         # Log groups                                                           #
@@ -133,10 +140,22 @@ class EcsStack(Stack):
             cluster=cluster,
             task_definition=backend_task_def,
             service_name="modernizer-backend",
-            desired_count=1,
+            # No desired_count: it would reset the running count on every
+            # deploy, undoing any scale-out; min_capacity below sets the floor
             security_groups=[backend_task_sg],
             vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
             assign_public_ip=False,
+            # Roll back a deployment whose tasks never become healthy
+            circuit_breaker=ecs.DeploymentCircuitBreaker(rollback=True),
+        )
+        # Each task runs a bounded number of analyses (MAX_CONCURRENT_ANALYSES);
+        # keep a second task warm and add more under sustained load
+        backend_scaling = backend_service.auto_scale_task_count(min_capacity=2, max_capacity=4)
+        backend_scaling.scale_on_cpu_utilization(
+            "BackendCpuScaling",
+            target_utilization_percent=60,
+            scale_in_cooldown=Duration.minutes(5),
+            scale_out_cooldown=Duration.seconds(60),
         )
         backend_listener.add_targets(
             "BackendTargets",
@@ -228,8 +247,13 @@ class EcsStack(Stack):
                 healthy_threshold_count=2,
                 unhealthy_threshold_count=3,
             ),
-            deregistration_delay=Duration.seconds(30),
-            stickiness_cookie_duration=Duration.hours(1),
+            # Streamlit keeps session state per task, so a reconnecting browser
+            # must return to the same one; the ALB renews the cookie on every
+            # response, so a short lifetime only drops idle sessions sooner.
+            # The target group stays HTTP/1.1: Streamlit's websocket stream
+            # can't be proxied over an HTTP/2 target group.
+            deregistration_delay=Duration.seconds(10),
+            stickiness_cookie_duration=Duration.minutes(5),
         )
 
         # Store service names for update script
@@ -1,4 +1,5 @@
-import xml.etree.ElementTree as ET
+import functools
+from lxml import etree as ET
 from pathlib import Path
 from aws_cdk import (
     Stack,
@@ -7,24 +8,50 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+_CONFIG_PATH = Path(__file__).parent.parent / "config.xml"
+# Written by scripts/gen_cidrs.py (`make cidrs`); not checked in
+_GENERATED_PATH = Path(__file__).with_name("_allowed_cidrs.py")
 
-def _load_allowed_cidrs() -> list[tuple[str, str]]:
+
+@functools.lru_cache(maxsize=1)
+def _load_allowed_cidrs() -> tuple[tuple[str, str], ...]:
+    """
+    Return (cidr, description) tuples for the frontend ALB whitelist, loaded
+    once per process however many stacks use it. The pre-generated literal is
+    used unless config.xml has been edited since it was written.
+    """
+    try:
+        if _GENERATED_PATH.stat().st_mtime >= _CONFIG_PATH.stat().st_mtime:
+            from ._allowed_cidrs import TUPLES
+            return TUPLES
+    except (FileNotFoundError, ImportError):
+        pass
+    return _parse_allowed_cidrs()
+
+
+def _parse_allowed_cidrs() -> tuple[tuple[str, str], ...]:
     """
-    Parse cdk/config.xml and return a list of (cidr, description) tuples
-    for the frontend ALB whitelist.
+    Parse cdk/config.xml and return (cidr, description) tuples for the
+    frontend ALB whitelist.
     """
-    config_path = Path(__file__).parent.parent / "config.xml"
-    tree = ET.parse(config_path)
-    root = tree.getroot()
+    # Stream the file instead of building the whole tree; the tag path from
+    # the root keeps the <frontend_alb><allowed_cidrs> constraint
+    path = []
     cidrs = []
-    for entry in root.findall("./frontend_alb/allowed_cidrs/cidr"):
-        cidr = entry.text.strip() if entry.text else ""
-        description = entry.attrib.get("description", cidr)
-        if cidr:
-            cidrs.append((cidr, description))
+    for event, entry in ET.iterparse(str(_CONFIG_PATH), events=("start", "end")):
+        if event == "start":
+            path.append(entry.tag)
+            continue
+        if path[1:] == ["frontend_alb", "allowed_cidrs", "cidr"]:
+            cidr = entry.text.strip() if entry.text else ""
+            description = entry.attrib.get("description", cidr)
+            if cidr:
+                cidrs.append((cidr, description))
+            entry.clear()
+        path.pop()
     if not cidrs:
         raise ValueError("config.xml has no <cidr> entries under <frontend_alb><allowed_cidrs>")
-    return cidrs
+    return tuple(cidrs)
 
 
 class NetworkStack(Stack):
@@ -93,4 +120,35 @@ class NetworkStack(Stack):
         )
         self.backend_task_sg.add_ingress_rule(self.backend_alb_sg, ec2.Port.tcp(8000))
 
+        # VPC endpoints — keep Bedrock, ECR image pulls and logs off the NAT
+        # gateway (per-GB charges, extra hop); only GitLab traffic needs it
+        self.vpc.add_gateway_endpoint(
+            "S3Endpoint",
+            service=ec2.GatewayVpcEndpointAwsService.S3,  # ECR image layers
+        )
+        endpoint_sg = ec2.SecurityGroup(
+            self,
+            "EndpointSg",
+            vpc=self.vpc,
+            description="AWS interface endpoints — allow HTTPS from ECS tasks",
+            allow_all_outbound=False,
+        )
+        # Fargate pulls images and ships logs through the task's own ENI
+        endpoint_sg.add_ingress_rule(self.backend_task_sg, ec2.Port.tcp(443))
+        endpoint_sg.add_ingress_rule(self.frontend_task_sg, ec2.Port.tcp(443))
+        for endpoint_id, service in [
+            ("BedrockRuntimeEndpoint", ec2.InterfaceVpcEndpointAwsService.BEDROCK_RUNTIME),
+            ("BedrockEndpoint", ec2.InterfaceVpcEndpointAwsService.BEDROCK),  # model listing
+            ("EcrApiEndpoint", ec2.InterfaceVpcEndpointAwsService.ECR),
+            ("EcrDkrEndpoint", ec2.InterfaceVpcEndpointAwsService.ECR_DOCKER),
+            ("LogsEndpoint", ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_LOGS),
+        ]:
+            self.vpc.add_interface_endpoint(
+                endpoint_id,
+                service=service,
+                subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS),
+                security_groups=[endpoint_sg],
+                open=False,
+            )
+
         CfnOutput(self, "VpcId", value=self.vpc.vpc_id)
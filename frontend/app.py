@@ -1,10 +1,16 @@
 """
 Streamlit frontend for the Modernization Analyzer.
 """
-import json
+import io
 import os
+import queue
+import threading
+import time
+import orjson
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------------------------------------------------------------------------
 # Config
@@ -12,6 +18,13 @@ import streamlit as st
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+# Minimum seconds between re-renders of the streaming report; each render
+# re-sends the whole report to the browser
+_RENDER_INTERVAL = 0.1
+
+_DATA_PREFIX = b"data: "
+_DATA_PREFIX_LEN = len(_DATA_PREFIX)
+
 st.set_page_config(
     page_title="Code Modernization Analyzer",
     page_icon="🔬",
@@ -23,38 +36,107 @@ st.set_page_config(
 # Helpers
 # ---------------------------------------------------------------------------
 
+@st.cache_resource
+def _http() -> requests.Session:
+    """One pooled session for the whole server, so backend connections are reused across reruns."""
+    session = requests.Session()
+    # One host, but the pool is shared by every browser session's stream.
+    # Only GETs are retried (ALB 5xx during a rolling deploy); retrying the
+    # /analyze POST would start a duplicate analysis
+    retry = Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_models() -> tuple[list[dict], str]:
+    # Raises on failure: Streamlit doesn't cache exceptions, so a backend
+    # outage is retried on the next rerun instead of pinning the fallback
+    resp = _http().get(f"{BACKEND_URL}/models", timeout=5)
+    resp.raise_for_status()
+    data = resp.json()
+    return data.get("available", []), data.get("default", "")
+
+
 def fetch_available_models() -> tuple[list[dict], str]:
     try:
-        resp = requests.get(f"{BACKEND_URL}/models", timeout=5)
-        if resp.ok:
-            data = resp.json()
-            return data.get("available", []), data.get("default", "")
+        return _fetch_models()
     except Exception:
         pass
     return [{"id": "anthropic.claude-3-5-sonnet-20241022-v2:0",
              "label": "Claude 3.5 Sonnet (recommended)"}], ""
 
 
-def stream_analysis(payload: dict):
+@st.cache_data(ttl=10, show_spinner=False)
+def _health() -> tuple[bool, str]:
+    """Probe /health; cached briefly so repeated clicks don't each block for up to 3 s."""
+    try:
+        r = _http().get(f"{BACKEND_URL}/health", timeout=3)
+        if r.ok:
+            return True, f"Connected — {r.json().get('status')}"
+        return False, f"HTTP {r.status_code}"
+    except Exception as e:
+        return False, f"Cannot reach backend: {e}"
+
+
+def stream_analysis(http: requests.Session, payload: dict):
     """
     POST to /analyze and yield parsed SSE events as (event_type, data) tuples.
     """
-    with requests.post(
+    with http.post(
         f"{BACKEND_URL}/analyze",
         json=payload,
+        # The backend gzips the event stream when asked; requests inflates it
+        headers={"Accept-Encoding": "gzip"},
         stream=True,
         timeout=600,
     ) as resp:
         if not resp.ok:
             yield "error", f"Backend error {resp.status_code}: {resp.text}"
             return
-        for raw_line in resp.iter_lines(decode_unicode=True):
-            if raw_line.startswith("data: "):
+        # Split raw bytes on newlines ourselves and decode only the data
+        # payloads; iter_lines(decode_unicode=True) is slow on fast streams
+        buf = bytearray()
+        for block in resp.iter_content(chunk_size=8192):
+            buf += block
+            while (nl := buf.find(b"\n")) >= 0:
+                raw_line = bytes(buf[:nl]).rstrip(b"\r")
+                del buf[:nl + 1]
+                # Blank lines separate events; skip them and other fields early
+                if not raw_line or raw_line[:_DATA_PREFIX_LEN] != _DATA_PREFIX:
+                    continue
+                data = raw_line[_DATA_PREFIX_LEN:]
                 try:
-                    event = json.loads(raw_line[6:])
+                    event = orjson.loads(data)
                     yield event.get("event", "chunk"), event.get("data", "")
-                except json.JSONDecodeError:
-                    yield "chunk", raw_line[6:]
+                except orjson.JSONDecodeError:
+                    yield "chunk", data.decode("utf-8", "replace")
+
+
+def _pump(http: requests.Session, payload: dict, events: queue.Queue) -> None:
+    """
+    Run stream_analysis on a background thread, putting each event on the
+    queue and None once the stream ends, so the script thread never blocks
+    on the network.
+    """
+    try:
+        for event in stream_analysis(http, payload):
+            events.put(event)
+    except requests.exceptions.ConnectionError:
+        events.put(("error", f"Cannot connect to the analysis backend at `{BACKEND_URL}`. "
+                             "Check that the backend service is running."))
+    except Exception as exc:
+        events.put(("error", f"Unexpected error: {exc}"))
+    finally:
+        events.put(None)
 
 
 # ---------------------------------------------------------------------------
@@ -69,11 +151,7 @@ with st.sidebar:
     model_labels = [m["label"] for m in models]
     model_ids = [m["id"] for m in models]
 
-    default_idx = 0
-    for i, mid in enumerate(model_ids):
-        if mid == default_model:
-            default_idx = i
-            break
+    default_idx = {mid: i for i, mid in enumerate(model_ids)}.get(default_model, 0)
 
     selected_idx = st.selectbox(
         "Bedrock Model",
@@ -87,14 +165,11 @@ with st.sidebar:
     st.subheader("Backend")
     backend_health = st.empty()
     if st.button("Check connection"):
-        try:
-            r = requests.get(f"{BACKEND_URL}/health", timeout=3)
-            if r.ok:
-                backend_health.success(f"Connected — {r.json().get('status')}")
-            else:
-                backend_health.error(f"HTTP {r.status_code}")
-        except Exception as e:
-            backend_health.error(f"Cannot reach backend: {e}")
+        healthy, message = _health()
+        if healthy:
+            backend_health.success(message)
+        else:
+            backend_health.error(message)
 
     st.divider()
     st.caption(f"Backend: `{BACKEND_URL}`")
@@ -168,6 +243,21 @@ if run_btn:
         "model_id": selected_model_id,
     }
 
+    events = queue.Queue()
+    threading.Thread(target=_pump, args=(_http(), payload, events), daemon=True).start()
+    # Kept in session state so a rerun mid-analysis (any widget interaction)
+    # picks up draining the same stream instead of losing it
+    st.session_state.analysis = {
+        "events": events,
+        "report": io.StringIO(),
+        "final": None,
+        "status": ("info", "⏳ Connecting to backend..."),
+        "tool": "",
+        "running": True,
+    }
+
+analysis = st.session_state.get("analysis")
+if analysis:
     st.divider()
     st.subheader("Analysis Progress")
 
@@ -178,42 +268,74 @@ if run_btn:
     with report_container:
         report_placeholder = st.empty()
 
-    accumulated_report = []
-    final_report = None
-
-    try:
-        with st.spinner("Connecting to backend..."):
-            events = stream_analysis(payload)
-
-        for event_type, data in events:
-            if event_type == "status":
-                status_placeholder.info(f"⏳ {data}")
-            elif event_type == "tool_use":
-                tool_placeholder.caption(f"🔧 {data}")
-            elif event_type == "tool_result":
-                tool_placeholder.caption("✅ Tool completed")
-            elif event_type == "chunk":
-                accumulated_report.append(data)
-                report_placeholder.markdown("".join(accumulated_report))
-            elif event_type == "done":
-                final_report = data
-                status_placeholder.success("✅ Analysis complete!")
-                tool_placeholder.empty()
-                report_placeholder.markdown(final_report or "".join(accumulated_report))
-            elif event_type == "error":
-                status_placeholder.error(f"❌ {data}")
-                break
+    def show_status() -> None:
+        kind, message = analysis["status"]
+        getattr(status_placeholder, kind)(message)
+
+    def show_tool() -> None:
+        if analysis["tool"]:
+            tool_placeholder.caption(analysis["tool"])
+        else:
+            tool_placeholder.empty()
+
+    show_status()
+    show_tool()
+    report_buf = analysis["report"]
+    if analysis["final"] or report_buf.tell():
+        report_placeholder.markdown(analysis["final"] or report_buf.getvalue())
+
+    events = analysis["events"]
+    last_render = time.monotonic()
+    rendered = report_buf.tell()
+    while analysis["running"]:
+        try:
+            event = events.get(timeout=_RENDER_INTERVAL)
+        except queue.Empty:
+            event = ()
+        if event is None:
+            analysis["running"] = False
+            break
 
-    except requests.exceptions.ConnectionError:
-        st.error(
-            f"Cannot connect to the analysis backend at `{BACKEND_URL}`. "
-            "Check that the backend service is running."
-        )
-    except Exception as exc:
-        st.error(f"Unexpected error: {exc}")
+        # Apply the event to session state before any Streamlit call: a rerun
+        # interrupts the script inside one of those calls, and the event is
+        # already off the queue
+        event_type = event[0] if event else None
+        if event_type == "status":
+            analysis["status"] = ("info", f"⏳ {event[1]}")
+        elif event_type == "tool_use":
+            analysis["tool"] = f"🔧 {event[1]}"
+        elif event_type == "tool_result":
+            analysis["tool"] = "✅ Tool completed"
+        elif event_type == "chunk":
+            report_buf.write(event[1])
+        elif event_type == "done":
+            analysis["final"] = event[1]
+            analysis["status"] = ("success", "✅ Analysis complete!")
+            analysis["tool"] = ""
+        elif event_type == "error":
+            analysis["status"] = ("error", f"❌ {event[1]}")
+            analysis["running"] = False
+
+        if event_type in ("status", "done", "error"):
+            show_status()
+        if event_type in ("tool_use", "tool_result", "done"):
+            show_tool()
+        now = time.monotonic()
+        if event_type == "done":
+            report_placeholder.markdown(analysis["final"] or report_buf.getvalue())
+            rendered = report_buf.tell()
+        # Render at most every _RENDER_INTERVAL, and also once the stream
+        # goes quiet so the tail of a burst isn't held back
+        elif report_buf.tell() != rendered and (not event or now - last_render >= _RENDER_INTERVAL):
+            report_placeholder.markdown(report_buf.getvalue())
+            rendered, last_render = report_buf.tell(), now
+
+    # Show chunks held back by the throttle if the stream ended without "done"
+    if analysis["final"] is None and report_buf.tell() != rendered:
+        report_placeholder.markdown(report_buf.getvalue())
 
     # Download button
-    report_text = final_report or "".join(accumulated_report)
+    report_text = analysis["final"] or report_buf.getvalue()
     if report_text:
         st.divider()
         st.download_button(
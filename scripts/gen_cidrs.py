@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Snapshot the frontend ALB whitelist in cdk/config.xml as a Python literal
+(cdk/stacks/_allowed_cidrs.py), so `cdk synth` can skip the XML parse.
+
+Usage:
+  python3 scripts/gen_cidrs.py    (or `make cidrs`)
+
+Run from the CDK environment (cdk/requirements.txt). NetworkStack falls back
+to parsing config.xml whenever it is newer than the generated file.
+"""
+import pprint
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "cdk"))
+from stacks.network_stack import _GENERATED_PATH, _parse_allowed_cidrs  # noqa: E402
+
+
+def main() -> None:
+    cidrs = _parse_allowed_cidrs()
+    _GENERATED_PATH.write_text(
+        "# Generated from cdk/config.xml by scripts/gen_cidrs.py — do not edit.\n"
+        f"TUPLES = {pprint.pformat(cidrs)}\n"
+    )
+    print(f"Wrote {len(cidrs)} CIDR(s) to {_GENERATED_PATH}")
+
+
+if __name__ == "__main__":
+    main()